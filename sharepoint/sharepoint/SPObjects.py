@@ -1,14 +1,36 @@
 # -*- coding: utf-8 -*-
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from functools import lru_cache
+import mmap
 import os
+import queue
+import shutil
+import threading
 from urllib.parse import parse_qs, urlsplit
 import uuid
 
 from sharepoint import manual_auth
 from sharepoint import get_api_client
+from sharepoint.api import BatchNotSupported
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Fields retrieved with $select when listing objects of each SharePoint type. Other attributes are still
+# available through SPObject.attribute but cost an extra request.
+SELECT_DEFAULTS = {
+    'SP.File': ['Name', 'ServerRelativeUrl', 'CheckOutType'],
+    'SP.Folder': ['Name', 'ServerRelativeUrl'],
+}
+
+# ETags of downloaded files keyed by local path. Values are (etag, mtime) so that a changed local copy isn't trusted.
+_etag_cache = {}
+
+# Marks a LazyAttribute whose value has not been retrieved. Falsy values such as 0, '' or [] are valid values.
+_UNSET = object()
+
 
 def site_login(url, getpass, logging=False):
     auth = manual_auth(getpass)
@@ -28,24 +50,91 @@ def get_new_site(url, old_site, logging=False):
 
 
 def _json_to_object(json, api_client):
-    sp_type = json['__metadata']['type'].replace(".", "")
+    sp_type = json['__metadata']['type']
     logger.debug("Attribute is an object of type {}. Creating object.".format(sp_type))
-    try:  # Check if class is implemented in python
-        sp_class = globals()[sp_type]
-    except KeyError:
-        sp_class = SPObject
+    sp_class = _SP_TYPE_MAP.get(sp_type, SPObject)  # Use generic SPObject if class is not implemented in python
     return sp_class(json['__metadata']['uri'], api_client, json)
 
 
+def _local_path(destination):
+    """
+    Convert destination argument of download methods to absolute local path
+    """
+    return os.path.abspath(destination.strip('/'))
+
+
+def _saved_etag(file_path):
+    """
+    Get ETag saved by a previous download of file_path.
+    :param file_path: Local path of downloaded file
+    :return: String with ETag or None if local file is missing, changed or has no saved ETag
+    """
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError:  # No local copy
+        return None
+    cached = _etag_cache.get(file_path)
+    if cached and cached[1] == mtime:
+        return cached[0]
+    try:
+        with open(file_path + '.etag') as f:
+            etag, saved_mtime = f.read().split('\n')[:2]
+        saved_mtime = float(saved_mtime)
+    except (OSError, ValueError):  # No saved ETag
+        return None
+    if saved_mtime != mtime:  # Local copy was modified after download
+        return None
+    _etag_cache[file_path] = (etag, mtime)
+    return etag
+
+
+def _save_etag(file_path, etag):
+    """
+    Save ETag and modification time of downloaded file to sidecar .etag file and in-process cache.
+    """
+    mtime = os.path.getmtime(file_path)
+    with open(file_path + '.etag', 'w') as f:
+        f.write('{0}\n{1!r}'.format(etag, mtime))
+    _etag_cache[file_path] = (etag, mtime)
+
+
+def _download_all(downloads, max_workers):
+    """
+    Download files concurrently. Network and disk I/O release the GIL so threads scale until bandwidth saturates.
+    :param downloads: List of (SPFile, destination) tuples
+    :param max_workers: Number of download threads
+    :return: None
+    """
+    # Create folders before starting threads so that threads don't race to create the same folder
+    for destination in {destination for _, destination in downloads}:
+        os.makedirs(_local_path(destination), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(file.download, destination) for file, destination in downloads]
+        try:
+            for future in as_completed(futures):
+                future.result()  # Raise on first failure
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+@lru_cache(maxsize=128)
+def _stringify_guid(guid):
+    """
+    Upload loops pass the same upload id with every chunk so cache the formatted value.
+    """
+    return "guid'{}'".format(guid)
+
+
 def _stringify(obj):
-    try:  # If object is a string, encode apostrophe and place single quotes around it
-        obj = obj.replace("'", "%27%27")  # Encoding apostrophe prevents interference early termination of quotes
-        return "'" + obj + "'"
-    except AttributeError:  # If object is not a string, convert it to a string without quotes
-        if type(obj) == uuid.UUID:
-            return "guid'{}'".format(str(obj))
-        else:
-            return str(obj)
+    if isinstance(obj, str):  # Encode apostrophe and place single quotes around string
+        return "'" + obj.replace("'", "%27%27") + "'"  # Encoding apostrophe prevents early termination of quotes
+    elif isinstance(obj, uuid.UUID):
+        return _stringify_guid(obj)
+    else:  # Convert other objects to a string without quotes
+        return str(obj)
 
 
 class SPObject(object):
@@ -62,14 +151,9 @@ class SPObject(object):
         :param kwargs: named arguments
         :return: Dict for json response
         """
-        args = ', '.join([_stringify(arg) for arg in args])
-        kwargs = ', '.join(["{0}={1}".format(key, _stringify(val)) for key, val in kwargs.items()])
-        all_args = ', '.join([args, kwargs]).strip(', ')
-        call_str = "/{name}({args})".format(
-            name=method_name,
-            args=all_args
-        )
-        return call_str
+        parts = [_stringify(arg) for arg in args]
+        parts.extend(f"{key}={_stringify(val)}" for key, val in kwargs.items())
+        return f"/{method_name}({', '.join(parts)})"
 
     def __init__(self, url, api_client, json=None):
         # json is dict with attribute values. Don't include 'd' key with json
@@ -80,13 +164,8 @@ class SPObject(object):
         if json:
             logger.debug('JSON was supplied. Parsing into attributes')
             json.pop('__metadata')
-            for name, val in json.items():
-                logger.debug('Setting attribute {}'.format(name))
-                if type(val) is dict:
-                    # Attribute is deferred so ignore it
-                    pass
-                else:
-                    self._attributes[name] = val
+            # Deferred attributes are dicts so ignore them
+            self._attributes = {name: val for name, val in json.items() if not isinstance(val, dict)}
 
     def __repr__(self):
         return self._repr_text(self._endpoint_url)
@@ -94,16 +173,22 @@ class SPObject(object):
     def _repr_text(self, path_text):
         return "{0} {1}".format(type(self), path_text)
 
-    def attribute(self, name):
+    def attribute(self, name, select=None):
+        """
+        Get attribute value. Value is only retrieved from SharePoint on first access.
+        :param name: Attribute name
+        :param select: List of fields to retrieve if attribute is an object or list of objects
+        :return: Attribute value
+        """
         logger.debug("Retrieving attribute: {}".format(name))
         # Retrieve value if already stored
-        if name in self._attributes.keys():
+        if name in self._attributes:
             logger.debug("Attribute was already stored. Retrieving value.")
             return self._attributes[name]
         else:
             url = self._attribute_url(name)
             logger.debug("Getting attribute from: {}".format(url))
-            self._attributes[name] = LazyAttribute(url, self._api_client, name).value()
+            self._attributes[name] = LazyAttribute(url, self._api_client, name).value(select=select)
             return self._attributes[name]
 
     def lazy_attribute(self, name):
@@ -133,23 +218,54 @@ class LazyAttribute(SPObject):
         self._value = self._parse_json(value)
         super(LazyAttribute, self).__init__(url, api_client)
 
-    def value(self, query=None):
-
-        if not self._value:
+    def value(self, query=None, select=None):
+        """
+        Get value, retrieving it from SharePoint if needed.
+        :param query: dict with OData query options
+        :param select: List of fields to retrieve. Merged into query as $select.
+        :return: Attribute value
+        """
+        if self._value is _UNSET:
+            if select:
+                query = dict(query or {}, **{'$select': ','.join(select)})
             json = self._api_client.get(self._endpoint_url, query).json()['d']
             logger.debug("Response for attribute {0}:\n{1}".format(self._name, json))
             self._value = self._parse_json(json)
         return self._value
 
+    @classmethod
+    def prefetch(cls, attributes):
+        """
+        Retrieve values for several LazyAttributes with a single batch request.
+        :param attributes: List of LazyAttribute objects. All attributes must share the same api_client.
+        :return: None
+        """
+        pending = [attribute for attribute in attributes if attribute._value is _UNSET]
+        if not pending:
+            return
+        try:
+            responses = pending[0]._api_client.batch([attribute._endpoint_url for attribute in pending])
+        except BatchNotSupported:
+            for attribute in pending:
+                attribute.value()
+            return
+        for attribute, r in zip(pending, responses):
+            json = r.json()['d']
+            logger.debug("Batch response for attribute {0}:\n{1}".format(attribute._name, json))
+            attribute._value = attribute._parse_json(json)
+
     def _parse_json(self, json):
         logger.debug('Parsing json')
-        if not json:
+        if json is None:
+            logger.debug('No json supplied. Value will be retrieved when requested')
+            value = _UNSET
+        elif not json:
             logger.debug('Value is not json. Setting value to None')
             value = None
-        elif self._name in json.keys():
+        elif self._name in json:
             logger.debug('Attribute found in json.')
             value = json[self._name]
-        elif 'results' in json.keys():  # json is a list
+        elif 'results' in json:  # json is a list
             results = [result for result in json['results']]
             logger.debug('Attribute is a list with length {0}. Parsing each item.'.format(len(json['results'])))
             value = [_json_to_object(item, self._api_client) for item in results]
@@ -177,6 +293,18 @@ class SPSite(SPObject):
     All other class instances will be ultimately created through methods from this class.
     """
 
+    # Site attributes that don't change during a session. Retrieved once when the object is created.
+    _PREFETCH_ATTRIBUTES = ['ServerRelativeUrl', 'Title', 'Url']
+
+    def __init__(self, url, api_client, json=None):
+        super(SPSite, self).__init__(url, api_client, json)
+        missing = [name for name in self._PREFETCH_ATTRIBUTES if name not in self._attributes]
+        if missing:
+            logger.debug("Prefetching site attributes: {}".format(missing))
+            site_json = self._api_client.get(self._endpoint_url, {'$select': ','.join(missing)}).json()['d']
+            site_json.pop('__metadata', None)
+            self._attributes.update(site_json)
+
     def __repr__(self):
         return self._repr_text(self.attribute('Title'))
 
@@ -203,11 +331,10 @@ class SPSite(SPObject):
         """
         parts = urlsplit(url)
         query = parse_qs(parts.query)
-        keys = query.keys()
-        if "sourcedoc" in keys:
+        if "sourcedoc" in query:
             uid = query['sourcedoc'][0][1:-1]
             return self.get_file_by_id(uid)
-        elif "SourceUrl" in keys:
+        elif "SourceUrl" in query:
             path = query['SourceUrl'][0] 
             path = '/' + '/'.join(path.split('/')[3:])
             # Check for invalid .xlsf extension
@@ -225,36 +352,55 @@ class SPSite(SPObject):
 
     def _append_site_path(self, path):
         """
-
+        Prefix path with server relative url of site unless it is already included.
         :param path:
         :return:
         """
-        if not path.startswith(self.attribute('ServerRelativeUrl')):
-            path = self.attribute('ServerRelativeUrl') + '/' + path.strip('/')
-        return path
+        # Prefetched in __init__. attribute() is only a fallback.
+        site_path = self._attributes.get('ServerRelativeUrl') or self.attribute('ServerRelativeUrl')
+        return path if path.startswith(site_path) else f"{site_path}/{path.strip('/')}"
 
 
 class SPFolder(SPObject):
 
+    # Largest file sent with a single add request. Larger files are uploaded in chunks.
+    _SINGLE_POST_LIMIT = 250*1024*1024
+
+    # Query used to retrieve sub-folders and files together with the folder itself
+    _EXPAND_CHILDREN = {
+        '$expand': 'Folders,Files',
+        '$select': ','.join(SELECT_DEFAULTS['SP.Folder'] +
+                            ['Folders/' + name for name in SELECT_DEFAULTS['SP.Folder']] +
+                            ['Files/' + name for name in SELECT_DEFAULTS['SP.File']]),
+    }
+
     def __repr__(self):
         return self._repr_text(self.attribute('ServerRelativeUrl'))
 
-    def download_files(self, destination='.'):
+    def download_files(self, destination='.', max_workers=8):
         """
         Download all files in given folder. Ignores sub-folders.
 
         :param destination: Destination path where files will be saved.
+        :param max_workers: Number of files downloaded concurrently.
         :return: None
         """
-        for file in self.attribute('Files'):
-            if os.path.splitext(file.attribute('Name'))[1] not in ['.aspx']:  # Downloading .aspx results in 403 forbidden error
-                file.download(destination)
+        _download_all(self._file_downloads(destination), max_workers)
 
-    def download(self, destination='.', maxdepth=None):
+    def _file_downloads(self, destination):
+        """
+        List (SPFile, destination) pairs for all files in folder that can be downloaded.
+        """
+        # Downloading .aspx results in 403 forbidden error
+        return [(file, destination) for file in self.attribute('Files', select=SELECT_DEFAULTS['SP.File'])
+                if os.path.splitext(file.attribute('Name'))[1] not in ['.aspx']]
+
+    def download(self, destination='.', maxdepth=None, max_workers=8):
         """
         Download all files and sub-folders up to specified depth.
         :param destination: Top-level path where files will be saved.
         :param maxdepth: Number of sub-folder levels to retrieve. To get all subfolders, set level to -1.
+        :param max_workers: Number of files downloaded concurrently.
         :return: None
         """
 
@@ -262,43 +408,90 @@ class SPFolder(SPObject):
 
         destination = destination.strip('/')
         logger.debug("Start download of {}".format(base_path))
+        downloads = []
         for folder, _, _, in self.walk(maxdepth=maxdepth):
             logger.debug('Inside {}'.format(folder.attribute('Name')))
             folder_path = folder.attribute('ServerRelativeUrl')[len(base_path):]
             logger.debug('Folder path: {}'.format(folder_path))
             dest_folder = destination + '/' + folder_path
-            folder.download_files(dest_folder)
+            downloads += folder._file_downloads(dest_folder)
+        _download_all(downloads, max_workers)
 
     def listdir(self):
         return self.attribute('Files') + self.attribute('Folders')
 
     def walk(self, topdown=True, maxdepth=None):
         """
-        Analogous to os.walk
+        Analogous to os.walk. Folders are visited level by level so that the contents of every folder
+        in a level are retrieved with a single batch request. Sub-folders and files of each folder are expanded
+        into the folder request.
         :param topdown:
         :param maxdepth: Maximum recursion depth.
         :return:
         """
-        top = self
-        folders = self.attribute('Folders')
-        logger.debug("Inside walk. Folders retrieved.")
-        files = self.attribute('Files')
-        logger.debug("Inside walk. Files retrieved.")
-
-        if topdown:
-            logger.debug("Reached walk endpoint.")
-            yield top, folders, files
-
-        if maxdepth is None or maxdepth > 1:
-            for folder in folders:
-                if maxdepth:
-                    newdepth = maxdepth - 1
-                else:
-                    newdepth = None
-                for x in folder.walk(topdown, newdepth):
-                    yield x
+        pending = deque([(self, 1)])
+        visited = []
+        while pending:
+            folder, depth = pending.popleft()
+            if 'Folders' not in folder._attributes or 'Files' not in folder._attributes:
+                # First folder of a new level. Remaining queue holds the rest of the level so fetch them together.
+                self._prefetch_children([folder] + [queued for queued, _ in pending])
+                logger.debug("Inside walk. Folders and files retrieved for level {}.".format(depth))
+            folders = folder.attribute('Folders')
+            entry = (folder, folders, folder.attribute('Files'))
+            if topdown:
+                yield entry
+            else:
+                visited.append(entry)
+
+            if maxdepth is None or depth < maxdepth:
+                pending.extend((sub_folder, depth + 1) for sub_folder in folders)
+
         if not topdown:
-            yield top, folders, files
+            for entry in reversed(visited):
+                yield entry
+
+    def _expand_children(self):
+        """
+        Retrieve Folders and Files attributes with a single request by expanding them in the folder request.
+        :return: None
+        """
+        json = self._api_client.get(self._endpoint_url, self._EXPAND_CHILDREN).json()['d']
+        self._store_children(json)
+
+    def _store_children(self, json):
+        """
+        Populate attributes from json of a folder request with expanded Folders and Files.
+        :param json: dict from 'd' key of response
+        :return: None
+        """
+        for name, val in json.items():
+            if name in ('Folders', 'Files'):
+                self._attributes[name] = [_json_to_object(item, self._api_client) for item in val['results']]
+            elif name != '__metadata' and not isinstance(val, dict):
+                self._attributes.setdefault(name, val)
+
+    @staticmethod
+    def _prefetch_children(folders):
+        """
+        Retrieve Folders and Files attributes for all folders with as few requests as possible.
+        :param folders: List of SPFolder objects
+        :return: None
+        """
+        pending = [folder for folder in folders
+                   if 'Folders' not in folder._attributes or 'Files' not in folder._attributes]
+        if len(pending) == 1:  # Plain request is cheaper than a batch with a single operation
+            pending[0]._expand_children()
+        elif pending:
+            api_client = pending[0]._api_client
+            try:
+                responses = api_client.batch([(folder._endpoint_url, SPFolder._EXPAND_CHILDREN) for folder in pending])
+            except BatchNotSupported:  # Request each folder separately
+                for folder in pending:
+                    folder._expand_children()
+                return
+            for folder, r in zip(pending, responses):
+                folder._store_children(r.json()['d'])
 
     def upload_file(self, filename, overwrite=True):
         """
@@ -311,29 +504,37 @@ class SPFolder(SPObject):
         chunk_size = 1024*1024
 
         file_base = os.path.split(filename)[1]
-        stream = False
-        if file_size <= chunk_size:
-            with open(filename, 'rb') as f:
-                file = f.read()
-        else:
-            file = None  # Don't include data with add method. Send it via streaming.
-            stream = True
+        stream = file_size > self._SINGLE_POST_LIMIT
+        with ExitStack() as stack:
+            if file_size <= chunk_size:
+                with open(filename, 'rb') as f:
+                    file = f.read()
+            elif not stream:
+                # requests sends the memory-mapped file in a single request without reading it all into memory
+                f = stack.enter_context(open(filename, 'rb'))
+                file = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                file = None  # Don't include data with add method. Send it via streaming.
+
+            try:
+                # This runs even if streaming upload is used because an empty file must be created before streaming starts
+                r = self.lazy_attribute('Files')._method_post('add',
+                                                              data=file,
+                                                              url=file_base,
+                                                              overwrite=str(overwrite).lower(),
+                                                              ).send()
+                file = _json_to_object(r.json()['d'], self._api_client)
+
+            except:
+                logger.exception("Upload Failed")
+                return
 
-        try:
-            # This runs even if streaming upload is used because an empty file must be created before streaming starts
-            r = self.lazy_attribute('Files')._method_post('add',
-                                                          data=file,
-                                                          url=file_base,
-                                                          overwrite=str(overwrite).lower(),
-                                                          ).send()
-            file = _json_to_object(r.json()['d'], self._api_client)
-
-        except:
-            logger.exception("Upload Failed")
-            return
-            
         if stream:
-            self._stream_upload(filename, file_size, chunk_size)
+            try:
+                self._stream_upload(filename, file_size, chunk_size)
+            except:
+                logger.exception("Upload Failed")
+                return
 
         print("Uploaded {0} to {1}".format(filename, self.attribute('ServerRelativeUrl')))
         if file.attribute('CheckOutType') != 2:
@@ -351,31 +552,63 @@ class SPFolder(SPObject):
         :return:
         """
         guid = uuid.uuid4()
-        first_chunk = True
-        f = open(filename, 'rb')
         i = self._endpoint_url.find("Web") + 3
         site_url = self._endpoint_url[:i]
         # Add empty file to folder
-        relative_path = self.attribute('ServerRelativeUrl')
+        relative_path = self.attribute('ServerRelativeUrl') + '/' + os.path.basename(filename)
         file = (SPObject(site_url, self._api_client).  # create site level object to access GetFileBy... method
-                _method_get('GetFileByServerRelativeUrl', ServerRelativeUrl=relative_path + '/' + filename))
-        try:
-            offset = 0
-            while True:
-                data = f.read(chunk_size)
-                if first_chunk:
-                    file._method_post('startupload', uploadId=guid, data=data).send()
-                    first_chunk = False
-                elif offset >= file_size - chunk_size:
-                    file._method_post('finishupload', uploadId=guid, fileOffset=offset, data=data).send()
-                    break
-                else:
-                    file._method_post('continueupload', uploadId=guid, fileOffset=offset, data=data).send()
-                offset += len(data)
-        except:
-            f.close()
-            logger.debug('Upload Failed')
-            file._method_post('cancelupload', guid).send()
+                _method_get('GetFileByServerRelativeUrl', ServerRelativeUrl=relative_path))
+
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Chunks are read in a separate thread so that disk reads overlap with sending the previous chunk
+            chunks = queue.Queue(maxsize=4)
+            stop = threading.Event()
+            reader = threading.Thread(target=self._read_chunks, args=(mm, chunk_size, chunks, stop), daemon=True)
+            reader.start()
+            try:
+                offset = 0
+                for data in iter(chunks.get, None):
+                    if isinstance(data, Exception):  # Reading file failed
+                        raise data
+                    if offset == 0:
+                        file._method_post('startupload', uploadId=guid, data=data).send()
+                    elif offset + len(data) >= file_size:
+                        file._method_post('finishupload', uploadId=guid, fileOffset=offset, data=data).send()
+                    else:
+                        file._method_post('continueupload', uploadId=guid, fileOffset=offset, data=data).send()
+                    offset += len(data)
+            except:
+                logger.debug('Upload Failed')
+                file._method_post('cancelupload', guid).send()
+                raise
+            finally:
+                # Unblock reader if it is waiting on a full queue
+                stop.set()
+                while not chunks.empty():
+                    chunks.get_nowait()
+                reader.join()
+
+    @staticmethod
+    def _read_chunks(mm, chunk_size, chunks, stop):
+        """
+        Put consecutive chunks of memory-mapped file on queue. None is put on queue after the last chunk.
+        If reading fails the exception is put on queue instead so that the uploading thread can cancel the upload.
+        :param mm: mmap.mmap of file
+        :param chunk_size:
+        :param chunks: queue.Queue shared with uploading thread
+        :param stop: threading.Event set by uploading thread when upload ends early
+        :return: None
+        """
+        for offset in range(0, len(mm), chunk_size):
+            if stop.is_set():
+                return
+            try:
+                chunk = mm[offset:offset + chunk_size]
+            except Exception as e:
+                chunks.put(e)
+                return
+            chunks.put(chunk)
+        chunks.put(None)
 
 
 class SPFile(SPObject):
@@ -387,25 +620,42 @@ class SPFile(SPObject):
         """
         Download single file from SharePoint.
 
+        The ETag of the file is saved next to it in a .etag file. If the local copy is unchanged, later downloads
+        send the ETag with If-None-Match and skip the transfer when the file has not changed on SharePoint.
+
         :param destination: String with path where file will be saved.
         :return: None
         """
 
         # Download file
         # api_client is directly used instead of attribute because $value returns raw data rather than json
-        logger.debug("Starting download: {}".format(self.attribute('Name')))
-        r = self._api_client.get(self._endpoint_url + '/$value')
+        name = self.attribute('Name')
+        logger.debug("Starting download: {}".format(name))
+        folder = _local_path(destination)
+        os.makedirs(folder, exist_ok=True)
+        file_path = os.path.join(folder, name)
+
+        etag = _saved_etag(file_path)
+        headers = {'If-None-Match': etag} if etag else None
+        with self._api_client.get(self._endpoint_url + '/$value', stream=True, headers=headers) as r:
+            if r.status_code == 304:
+                print("File {0} is already up to date".format(file_path))
+                return
+            logger.debug("Writing file to disk")
+            r.raw.decode_content = True  # Undo gzip/deflate transfer encoding
+            with open(file_path, 'wb') as f:
+                shutil.copyfileobj(r.raw, f, length=1024*1024)
+            etag = r.headers.get('ETag')
         logger.debug("Download complete")
-        destination = destination.strip('/')
-        destination = os.path.abspath(destination)
-
-        if not os.path.isdir(destination):
-            os.makedirs(destination)
-
-        destination = os.path.join(destination, self.attribute('Name'))
-        logger.debug("Writing file to disk")
-        with open(destination, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=128):
-                f.write(chunk)
-        
-        print("Successfully downloaded file as {0}".format(destination))
\ No newline at end of file
+
+        if etag:
+            _save_etag(file_path, etag)
+        print("Successfully downloaded file as {0}".format(file_path))
+
+
+# SharePoint types implemented in python. Used by _json_to_object to choose the class of new objects.
+_SP_TYPE_MAP = {
+    'SP.Web': SPSite,
+    'SP.Folder': SPFolder,
+    'SP.File': SPFile,
+}
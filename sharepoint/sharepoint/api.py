@@ -2,9 +2,32 @@
 from datetime import datetime, timedelta
 import logging
 import os
+import re
+import uuid
 from json import JSONDecodeError
 from urllib.parse import urlsplit
 
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:  # orjson decodes large folder listings several times faster than the json module used by requests
+    import orjson
+except ImportError:
+    orjson = None
+
+# SharePoint rejects $batch requests containing more than 100 operations
+BATCH_LIMIT = 100
+
+# Status codes returned by servers without a $batch endpoint, e.g. SharePoint 2013 on-premises
+BATCH_UNSUPPORTED_CODES = (400, 404, 501)
+
+
+class BatchNotSupported(Exception):
+    """
+    Raised by APIclient.batch when the server doesn't support $batch requests.
+    Callers should fall back to sending requests one at a time.
+    """
+
 
 def get_api_client(url, auth, logging=False):
     return APIclient(url, auth, logging)
@@ -26,6 +49,50 @@ def _remove_filename(path):
         return path
 
 
+def _use_fast_json(r):
+    """
+    Replace json method of response with orjson if it is installed. Callers only use r.json() so they are unaffected.
+    orjson.JSONDecodeError is a subclass of json.JSONDecodeError so error handling is unchanged.
+    :param r: requests.Response object with body already downloaded
+    :return: None
+    """
+    if orjson is not None:
+        r.json = lambda **kwargs: orjson.loads(r.content)
+
+
+def _parse_batch_response(r, urls):
+    """
+    Split multipart response from a $batch call into one requests.Response object per operation.
+    :param r: requests.Response object returned by the $batch call
+    :param urls: List of urls in the same order as the operations in the batch
+    :return: List of requests.Response objects
+    """
+    boundary = re.search('boundary=([^;]+)', r.headers['Content-Type']).group(1).strip('"')
+    parts = r.content.split(b'--' + boundary.encode())[1:-1]  # Drop preamble and closing delimiter
+    if len(parts) != len(urls):
+        raise Exception('Batch response has {0} parts for {1} requests\nRequest: POST {2}'.format(
+            len(parts), len(urls), r.url))
+    responses = []
+    for part, url in zip(parts, urls):
+        _, message = part.strip(b'\r\n').split(b'\r\n\r\n', 1)  # Drop MIME headers of the part
+        head, _, body = message.partition(b'\r\n\r\n')
+        lines = head.decode().split('\r\n')
+        _, code, reason = (lines[0].split(' ', 2) + [''])[:3]
+
+        response = requests.Response()
+        response.status_code = int(code)
+        response.reason = reason
+        headers = [line.split(':', 1) for line in lines[1:] if ':' in line]
+        response.headers = CaseInsensitiveDict({key.strip(): val.strip() for key, val in headers})
+        response._content = body.rstrip(b'\r\n')
+        response.encoding = 'utf-8'
+        response.url = url
+        response.request = requests.Request('GET', url).prepare()
+        _use_fast_json(response)
+        responses.append(response)
+    return responses
+
+
 class APIclient(object):
 
     """
@@ -56,19 +123,17 @@ class APIclient(object):
         url = _remove_filename(url)
         self.api_url = self._get_api_url(url)
 
-        # Form digest expiration. An unexpired digest token is required for posting
-        # Setting to now guarantees that a new digest token is requested upon the first post
-        self.expire = datetime.now()
-
         # Configure Logging
         self.logger = self._create_logger(logging)
 
-    def get(self, url, params=None):
+    def get(self, url, params=None, stream=False, headers=None):
         """
         Call _http with GET
+        :param stream: If True, body is not downloaded until it is read from the response
+        :param headers: dict with extra headers for this request
         """
 
-        r = self.http(url, 'GET', params)
+        r = self.http(url, 'GET', params, stream=stream, headers=headers)
         return r
 
     def post(self, url, data=None):
@@ -81,6 +146,58 @@ class APIclient(object):
         r = self.http(url, 'POST', data)
         return r
 
+    def batch(self, gets):
+        """
+        Send several GET requests in as few round-trips as possible using the OData $batch endpoint.
+        :param gets: List of urls or (url, params) tuples
+        :return: List of requests.Response objects in the same order as gets
+        :raises BatchNotSupported: If server rejected an earlier or the current $batch request
+        """
+        if not self.auth.batch_supported:
+            raise BatchNotSupported(self.api_url)
+        responses = []
+        for i in range(0, len(gets), BATCH_LIMIT):
+            responses.extend(self._send_batch(gets[i:i + BATCH_LIMIT]))
+        return responses
+
+    def _send_batch(self, gets):
+        """
+        Package GET requests into a single multipart $batch POST.
+        :param gets: List of urls or (url, params) tuples. Length must not exceed BATCH_LIMIT.
+        :return: List of requests.Response objects
+        """
+        boundary = 'batch_{}'.format(uuid.uuid4())
+        urls = []
+        body = []
+        for get in gets:
+            url, params = get if isinstance(get, tuple) else (get, None)
+            url = requests.Request('GET', url, params=params).prepare().url
+            urls.append(url)
+            body += ['--' + boundary,
+                     'Content-Type: application/http',
+                     'Content-Transfer-Encoding: binary',
+                     '',
+                     'GET {} HTTP/1.1'.format(url),
+                     'Accept: application/json; odata=verbose',
+                     '']
+        body += ['--' + boundary + '--', '']
+
+        self.logger.debug("Batch request with {0} operations to {1}".format(len(urls), self.api_url))
+        r = self._session.post(self.api_url + '/$batch', data='\r\n'.join(body),
+                               headers={'Content-type': 'multipart/mixed; boundary={}'.format(boundary),
+                                        'X-RequestDigest': self._digest()})
+        if r.status_code in BATCH_UNSUPPORTED_CODES:
+            # Remember so that later batches go straight to the fallback
+            self.logger.info("$batch rejected with status {0}. Disabling batch requests.".format(r.status_code))
+            self.auth.batch_supported = False
+            raise BatchNotSupported(self.api_url)
+        self._check_response(r)
+
+        responses = _parse_batch_response(r, urls)
+        for response in responses:
+            self._check_response(response)
+        return responses
+
     def _get_api_url(self, url):
         """
         Determines sharepoint_url to SharePoint api by looking up contextinfo property.
@@ -149,30 +266,42 @@ class APIclient(object):
 
     def _digest(self):
         """
-        If digest token is expired, obtain new value and update session header
-        :return:
-        """
-        if self.expire <= datetime.now():
-            r = self._session.post(self.api_url + '/contextinfo')
-            self._check_response(r)
-            contextinfo = r.json()['d']['GetContextWebInformation']
-            self._session.headers['X-RequestDigest'] = contextinfo['FormDigestValue']
-            self.expire = datetime.now() + timedelta(seconds=contextinfo['FormDigestTimeoutSeconds'])
+        Get form digest token for this site. If digest token is expired, obtain new value.
 
-    def http(self, url, verb, payload=None):
+        An unexpired digest token is required for posting. Tokens are stored on the auth object so that all
+        APIclients sharing a session reuse the same token. The lock makes refreshing safe when posting from threads.
+        :return: String with digest token
+        """
+        with self.auth.digest_lock:
+            # New sites start expired which guarantees that a new digest token is requested upon the first post
+            state = self.auth.digests.setdefault(self.api_url, {'value': None, 'expire': datetime.now()})
+            if state['expire'] <= datetime.now():
+                r = self._session.post(self.api_url + '/contextinfo')
+                self._check_response(r)
+                contextinfo = r.json()['d']['GetContextWebInformation']
+                state['value'] = contextinfo['FormDigestValue']
+                state['expire'] = datetime.now() + timedelta(seconds=contextinfo['FormDigestTimeoutSeconds'])
+            return state['value']
+
+    def http(self, url, verb, payload=None, stream=False, headers=None):
         """
         Make an http request
         :param url:
         :param verb:
+        :param stream: Defer downloading response body. Only used with GET.
+        :param headers: dict with extra headers for this request
         :return:
         """
         self.logger.debug("{0} request to {1}".format(verb, url))
+        headers = dict(headers or {})
         if verb.upper() == 'GET':
-            r = self._session.get(url, params=payload)
+            r = self._session.get(url, params=payload, stream=stream, headers=headers)
         elif verb.upper() == 'POST':
-            self._digest()
-            r = self._session.post(url, data=payload)
+            headers['X-RequestDigest'] = self._digest()
+            r = self._session.post(url, data=payload, headers=headers)
         else:
             raise Exception('HTTP verb {} not supported'.format(verb))
+        if not stream:
+            _use_fast_json(r)
         self._check_response(r)
         return r
@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
+from html import unescape
 import re
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import MissingSchema
+from urllib3.util.retry import Retry
 from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup
 
-import pdb
-# Suppress SSL verify warnings
-try:
-    from requests.packages.urllib3.exceptions import InsecureRequestWarning
+def _disable_insecure_warnings():
+    """
+    Suppress SSL verify warnings
+    """
+    try:
+        from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-except ModuleNotFoundError:
-    pass
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    except ModuleNotFoundError:
+        pass
 
 
 def manual_auth(getpass):
@@ -38,13 +44,53 @@ class ManualSPAuth(object):
     sharepoint_url = "https://fqdn.of.your.sharepoint"
     auth_failed_url = "https://fqdn.of.your.sharepoint/htdocs/public/auth_failed.html"
 
+    # Javascript redirect target on the sharepoint_url landing page
+    _REDIRECT_RE = re.compile(rb'https://[^"]*')
+
+    # Login pages are simple enough to scan with regular expressions. BeautifulSoup is only used if these miss.
+    # Comments, scripts and styles can contain markup that is not part of the page so they are removed first.
+    _IGNORED_RE = re.compile(r'<!--.*?-->|<script\b.*?</script\s*>|<style\b.*?</style\s*>',
+                             re.IGNORECASE | re.DOTALL)
+    _TAG_RE = re.compile(r'<(input|form)\b([^>]*)>', re.IGNORECASE)
+    # Attribute with double quoted, single quoted, unquoted or no value
+    _ATTR_RE = re.compile(r'([\w:.-]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+)))?')
+    _POST_RE = re.compile('post', re.IGNORECASE)
+
     def __init__(self, getpass):
         self.getpass = getpass
         self.logged_in = False
         self.session = requests.session()
         self.session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)'
-                                                   ' Chrome/61.0.3163.100 Safari/537.36'})
+                                                   ' Chrome/61.0.3163.100 Safari/537.36',
+                                     'Connection': 'keep-alive'})
+        # Larger connection pool so that bulk uploads/downloads reuse warm https connections.
+        # Retry transient server errors and throttling (429) on idempotent requests. Once retries run out the last
+        # response is returned so that APIclient._check_response can report the SharePoint error message.
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=retries)
+        self.session.mount('https://', adapter)
         self.session.verify = False  # Turn off SSL verification if using non-standard root CA
+        _disable_insecure_warnings()
+
+        # Form digest tokens shared by every APIclient using this session. Keyed by api url since each site
+        # issues its own token.
+        self.digests = {}
+        self.digest_lock = threading.Lock()
+
+        # Set to False by APIclient.batch if the server rejects $batch requests
+        self.batch_supported = True
+
+    def __getstate__(self):
+        # Locks can't be pickled. Digest tokens expire so they are requested again after unpickling.
+        state = self.__dict__.copy()
+        del state['digest_lock']
+        state['digests'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.digest_lock = threading.Lock()
 
     def login(self):
         r = self._get_login_page()
@@ -84,8 +130,13 @@ class ManualSPAuth(object):
         r = self.session.get(self.sharepoint_url)
 
         # Follow javascript redirect
-        regex = re.compile('https://[^"]*')
-        redirect = regex.findall(r.text)[1]
+        # Redirect is the second url on the page. Scan bytes to skip decoding and stop after the second match.
+        urls = self._REDIRECT_RE.finditer(r.content)
+        next(urls, None)
+        redirect = next(urls, None)
+        if redirect is None:
+            raise Exception('Login redirect not found')
+        redirect = redirect.group(0).decode()
         r = self.session.get(redirect)
         return r
 
@@ -99,11 +150,10 @@ class ManualSPAuth(object):
         data: dict of any user form data
         """
 
-        # Add hidden values to payload
-        post = re.compile('post', re.IGNORECASE)
-        soup = BeautifulSoup(r.text, 'lxml')
-        tags = soup.findAll('input', {'type': 'hidden'})
-        payload = {tag.attrs['name']: tag.attrs['value'] for tag in tags}
+        try:
+            payload, url = self._parse_form(r.text)
+        except ValueError:  # Page could not be fully parsed with regular expressions
+            payload, url = self._parse_form_soup(r.text)
 
         # Add user data to payload
         try:
@@ -111,9 +161,6 @@ class ManualSPAuth(object):
         except TypeError:  # No user supplied data
             pass
 
-        # Get response sharepoint_url
-        url = soup.findAll('form', method=post)[0].attrs['action']
-
         try:
             r = self.session.post(url, data=payload)
         except MissingSchema:  # If schema is missing, use domain from response sharepoint_url
@@ -122,3 +169,40 @@ class ManualSPAuth(object):
             r = self.session.post(url, data=payload)
 
         return r
+
+    def _parse_form(self, text):
+        """
+        Get hidden input values and action url of post form.
+
+        :param text: html with form
+        :return: Tuple with dict of hidden values and action url
+        """
+        payload = {}
+        url = None
+        text = self._IGNORED_RE.sub('', text)
+        for tag, attr_text in self._TAG_RE.findall(text):
+            if self._ATTR_RE.sub('', attr_text).strip(' \t\r\n/'):
+                # Some attribute text wasn't understood. Let BeautifulSoup parse the page rather than drop fields.
+                raise ValueError('Could not parse attributes of {0} tag: {1}'.format(tag, attr_text))
+            attrs = {name.lower(): unescape(double or single or bare)
+                     for name, double, single, bare in self._ATTR_RE.findall(attr_text)}
+            if tag.lower() == 'input':
+                if attrs.get('type', '').lower() == 'hidden' and 'name' in attrs:
+                    payload[attrs['name']] = attrs.get('value', '')
+            elif url is None and attrs.get('method', '').lower() == 'post' and 'action' in attrs:
+                url = attrs['action']
+        if url is None:
+            raise ValueError('Post form not found')
+        return payload, url
+
+    def _parse_form_soup(self, text):
+        """
+        Slower fallback for _parse_form using BeautifulSoup.
+        """
+        from bs4 import BeautifulSoup  # Imported here since it is slow to import and rarely needed
+
+        soup = BeautifulSoup(text, 'lxml')
+        tags = soup.findAll('input', {'type': 'hidden'})
+        payload = {tag.attrs['name']: tag.attrs['value'] for tag in tags}
+        url = soup.findAll('form', method=self._POST_RE)[0].attrs['action']
+        return payload, url